@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 from datetime import datetime
 import uuid
@@ -15,6 +15,20 @@ class Session(BaseModel):
 class MessageCreate(BaseModel):
     content: str
     message_type: str  # 'text' or 'image'
+    num_variants: int = Field(default=1, ge=1, le=4)  # for image generation
+    seeds: Optional[List[int]] = None  # one per variant, random when omitted
+    guidance_scale: Optional[float] = Field(default=None, gt=0, le=30)
+    num_inference_steps: Optional[int] = Field(default=None, ge=1, le=100)
+
+    @model_validator(mode='after')
+    def check_image_options(self):
+        if self.message_type != 'image':
+            if self.num_variants != 1 or self.seeds is not None or self.guidance_scale is not None \
+                    or self.num_inference_steps is not None:
+                raise ValueError("num_variants, seeds, guidance_scale and num_inference_steps are only valid for image messages")
+        if self.seeds is not None and len(self.seeds) != self.num_variants:
+            raise ValueError("seeds must contain exactly one seed per variant")
+        return self
 
 class Message(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -23,6 +37,9 @@ class Message(BaseModel):
     content: str
     content_type: Optional[str] = 'text'  # 'text' or 'image'
     prompt: Optional[str] = None  # for image generation
+    group_id: Optional[str] = None  # links image variants of one request
+    variant_index: Optional[int] = None
+    seed: Optional[int] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 class SessionWithMessages(BaseModel):
@@ -6,25 +6,42 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from typing import List
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
 import uuid
 from datetime import datetime
+import asyncio
 import base64
 import io
+import json
+import random
 
 from models import Session, SessionCreate, Message, MessageCreate, SessionWithMessages
 from services.huggingface_service import HuggingFaceService
+from services.archive_service import ArchiveService
+from services.coordination_service import CoordinationService, ModelSlotTimeout, ensure_indexes_safely
+from services.tracing import RequestTracer, span
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Pool is per worker process, size it for the number of uvicorn workers per host
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+    minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+)
 db = client[os.environ['DB_NAME']]
 
+# Cross-worker leases and in-flight deduplication
+coordination_service = CoordinationService(db)
+
 # Initialize HuggingFace service
-hf_service = HuggingFaceService()
+hf_service = HuggingFaceService(model_slot=coordination_service.model_slot)
+
+# Initialize cold session archiver
+archive_service = ArchiveService(db, coordination_service)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -37,8 +54,19 @@ api_router = APIRouter(prefix="/api")
 async def get_sessions():
     """Get all chat sessions"""
     try:
-        sessions_cursor = db.sessions.find().sort("updated_at", -1)
-        sessions = await sessions_cursor.to_list(1000)
+        with span("mongo.sessions.find"):
+            sessions_cursor = db.sessions.find().sort("updated_at", -1)
+            sessions = await sessions_cursor.to_list(1000)
+        
+        # Fill up with archived sessions, these are normally older than the hot ones
+        if len(sessions) < 1000:
+            with span("mongo.archived_sessions.find"):
+                archived = await archive_service.get_archived_sessions(1000 - len(sessions))
+            # A session can briefly exist in both places while it is being archived
+            hot_ids = {session["id"] for session in sessions}
+            sessions += [session for session in archived if session["id"] not in hot_ids]
+            sessions.sort(key=lambda session: session["updated_at"], reverse=True)
+        
         return [Session(**session) for session in sessions]
     except Exception as e:
         logging.error(f"Error fetching sessions: {str(e)}")
@@ -54,7 +82,8 @@ async def create_session(session_data: SessionCreate):
             updated_at=datetime.utcnow()
         )
         
-        await db.sessions.insert_one(session.dict())
+        with span("mongo.sessions.insert_one"):
+            await db.sessions.insert_one(session.dict())
         return session
     except Exception as e:
         logging.error(f"Error creating session: {str(e)}")
@@ -65,12 +94,16 @@ async def delete_session(session_id: str):
     """Delete a chat session and all its messages"""
     try:
         # Delete all messages in the session
-        await db.messages.delete_many({"session_id": session_id})
+        with span("mongo.messages.delete_many"):
+            await db.messages.delete_many({"session_id": session_id})
         
         # Delete the session
-        result = await db.sessions.delete_one({"id": session_id})
+        with span("mongo.sessions.delete_one"):
+            result = await db.sessions.delete_one({"id": session_id})
+        with span("mongo.archived_sessions.delete_one"):
+            archived = await archive_service.delete(session_id)
         
-        if result.deleted_count == 0:
+        if result.deleted_count == 0 and not archived:
             raise HTTPException(status_code=404, detail="Session not found")
         
         return {"message": "Session deleted successfully"}
@@ -85,99 +118,243 @@ async def delete_session(session_id: str):
 async def get_messages(session_id: str):
     """Get all messages for a session"""
     try:
-        messages_cursor = db.messages.find({"session_id": session_id}).sort("timestamp", 1)
-        messages = await messages_cursor.to_list(1000)
+        # Bring the session back to the hot collections if it was archived
+        with span("mongo.sessions.find_one"):
+            session = await db.sessions.find_one({"id": session_id}, {"_id": 1})
+        if not session:
+            with span("archive.rehydrate"):
+                await archive_service.rehydrate(session_id)
+        
+        with span("mongo.messages.find"):
+            messages_cursor = db.messages.find({"session_id": session_id}).sort("timestamp", 1)
+            messages = await messages_cursor.to_list(1000)
         return [Message(**message) for message in messages]
     except Exception as e:
         logging.error(f"Error fetching messages: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch messages")
 
-@api_router.post("/sessions/{session_id}/messages", response_model=Message)
-async def send_message(session_id: str, message_data: MessageCreate):
-    """Send a message and get AI response"""
-    try:
-        # Check if session exists
+async def save_user_message(session_id: str, message_data: MessageCreate) -> dict:
+    """Look up the session and store the user message, returns the session"""
+    # Check if session exists
+    with span("mongo.sessions.find_one"):
         session = await db.sessions.find_one({"id": session_id})
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        # Create user message
-        user_message = Message(
-            session_id=session_id,
-            type="user",
-            content=message_data.content,
-            content_type="text",
-            timestamp=datetime.utcnow()
-        )
-        
-        # Save user message
+    if not session:
+        with span("archive.rehydrate"):
+            session = await archive_service.rehydrate(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    # Create user message
+    user_message = Message(
+        session_id=session_id,
+        type="user",
+        content=message_data.content,
+        content_type="text",
+        timestamp=datetime.utcnow()
+    )
+    
+    # Save user message
+    with span("mongo.messages.insert_one"):
         await db.messages.insert_one(user_message.dict())
-        
-        # Generate AI response
-        if message_data.message_type == "image":
-            # Generate image
-            image_data = await hf_service.generate_image(message_data.content)
-            
-            if image_data:
-                assistant_message = Message(
-                    session_id=session_id,
-                    type="assistant",
-                    content=image_data,
-                    content_type="image",
-                    prompt=message_data.content,
-                    timestamp=datetime.utcnow()
-                )
-            else:
-                assistant_message = Message(
-                    session_id=session_id,
-                    type="assistant",
-                    content="Maaf, saya tidak dapat membuat gambar saat ini. Silakan coba lagi nanti.",
-                    content_type="text",
-                    timestamp=datetime.utcnow()
-                )
-        else:
-            # Generate text response
-            ai_response = await hf_service.generate_text(message_data.content)
+    return session
+
+async def touch_session(session: dict, message_data: MessageCreate):
+    """Update the session timestamp and its title after a new message"""
+    # Update session timestamp
+    with span("mongo.sessions.update_one"):
+        await db.sessions.update_one(
+            {"id": session["id"]},
+            {"$set": {"updated_at": datetime.utcnow()}}
+        )
+    
+    # Update session title if it's the first message
+    if session["title"] == "Percakapan Baru":
+        # Generate a title from the first user message (first 50 chars)
+        title = message_data.content[:50] + ("..." if len(message_data.content) > 50 else "")
+        with span("mongo.sessions.update_one"):
+            await db.sessions.update_one(
+                {"id": session["id"]},
+                {"$set": {"title": title}}
+            )
+
+async def run_generation(
+    model: str,
+    key_parts: tuple,
+    producer: Callable[[], Awaitable[Any]],
+    dedup: bool = True
+) -> Any:
+    """Run a generation, shared with identical in-flight ones on any worker
+    
+    The global per-model limit is applied inside HuggingFaceService.
+    """
+    if not dedup:
+        return await producer()
+    key = coordination_service.generation_key(model, *key_parts)
+    return await coordination_service.dedup(key, producer)
+
+async def generate_text_message(session_id: str, message_data: MessageCreate) -> Message:
+    """Generate and save the assistant reply for a text message"""
+    ai_response = await run_generation(
+        hf_service.llama_model,
+        (message_data.content,),
+        lambda: hf_service.generate_text(message_data.content)
+    )
+    
+    assistant_message = Message(
+        session_id=session_id,
+        type="assistant",
+        content=ai_response,
+        content_type="text",
+        timestamp=datetime.utcnow()
+    )
+    with span("mongo.messages.insert_one"):
+        await db.messages.insert_one(assistant_message.dict())
+    return assistant_message
+
+async def generate_image_messages(session_id: str, message_data: MessageCreate) -> AsyncIterator[Message]:
+    """Generate all requested image variants concurrently and save each one as it finishes"""
+    num_variants = message_data.num_variants
+    seeds = message_data.seeds
+    if seeds is None and num_variants > 1:
+        # Distinct seeds so the variants actually differ
+        seeds = [random.randint(0, 2**32 - 1) for _ in range(num_variants)]
+    group_id = str(uuid.uuid4()) if num_variants > 1 else None
+    
+    async def generate_variant(index: int):
+        seed = seeds[index] if seeds else None
+        image_data = await run_generation(
+            hf_service.stable_diffusion_model,
+            (message_data.content, seed, message_data.guidance_scale, message_data.num_inference_steps),
+            lambda: hf_service.generate_image(
+                message_data.content,
+                seed=seed,
+                guidance_scale=message_data.guidance_scale,
+                num_inference_steps=message_data.num_inference_steps
+            ),
+            # Without a seed two identical prompts are expected to give different images
+            dedup=seed is not None
+        )
+        return index, seed, image_data
+    
+    tasks = [asyncio.create_task(generate_variant(index)) for index in range(num_variants)]
+    generated = 0
+    try:
+        for task in asyncio.as_completed(tasks):
+            index, seed, image_data = await task
+            if not image_data:
+                continue
             
             assistant_message = Message(
                 session_id=session_id,
                 type="assistant",
-                content=ai_response,
-                content_type="text",
+                content=image_data,
+                content_type="image",
+                prompt=message_data.content,
+                group_id=group_id,
+                variant_index=index if group_id else None,
+                seed=seed,
                 timestamp=datetime.utcnow()
             )
-        
-        # Save AI response
-        await db.messages.insert_one(assistant_message.dict())
-        
-        # Update session timestamp
-        await db.sessions.update_one(
-            {"id": session_id},
-            {"$set": {"updated_at": datetime.utcnow()}}
+            with span("mongo.messages.insert_one"):
+                await db.messages.insert_one(assistant_message.dict())
+            generated += 1
+            yield assistant_message
+    finally:
+        # Client went away, a variant failed or the caller stopped early
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    if generated == 0:
+        assistant_message = Message(
+            session_id=session_id,
+            type="assistant",
+            content="Maaf, saya tidak dapat membuat gambar saat ini. Silakan coba lagi nanti.",
+            content_type="text",
+            timestamp=datetime.utcnow()
         )
+        with span("mongo.messages.insert_one"):
+            await db.messages.insert_one(assistant_message.dict())
+        yield assistant_message
+
+@api_router.post("/sessions/{session_id}/messages", response_model=Message)
+async def send_message(session_id: str, message_data: MessageCreate):
+    """Send a message and get AI response
+    
+    Multi-variant image requests must use the streaming endpoint.
+    """
+    if message_data.num_variants > 1:
+        raise HTTPException(
+            status_code=400,
+            detail="num_variants > 1 is only supported by /sessions/{session_id}/messages/stream"
+        )
+    
+    try:
+        session = await save_user_message(session_id, message_data)
         
-        # Update session title if it's the first message
-        if session["title"] == "Percakapan Baru":
-            # Generate a title from the first user message (first 50 chars)
-            title = message_data.content[:50] + ("..." if len(message_data.content) > 50 else "")
-            await db.sessions.update_one(
-                {"id": session_id},
-                {"$set": {"title": title}}
-            )
+        # Generate AI response
+        if message_data.message_type == "image":
+            assistant_message = [message async for message in generate_image_messages(session_id, message_data)][0]
+        else:
+            assistant_message = await generate_text_message(session_id, message_data)
         
+        await touch_session(session, message_data)
         return assistant_message
         
+    except HTTPException:
+        raise
+    except ModelSlotTimeout as e:
+        logging.warning(f"Error sending message: {str(e)}")
+        raise HTTPException(status_code=503, detail="Model is busy, please try again later")
+    except Exception as e:
+        logging.error(f"Error sending message: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to send message")
+
+@api_router.post("/sessions/{session_id}/messages/stream")
+async def send_message_stream(session_id: str, message_data: MessageCreate):
+    """Send a message and stream AI responses as newline-delimited JSON
+    
+    Image variants are written as soon as each one is generated.
+    """
+    try:
+        session = await save_user_message(session_id, message_data)
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error sending message: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to send message")
+    
+    async def stream():
+        try:
+            if message_data.message_type == "image":
+                async for assistant_message in generate_image_messages(session_id, message_data):
+                    yield assistant_message.json() + "\n"
+            else:
+                assistant_message = await generate_text_message(session_id, message_data)
+                yield assistant_message.json() + "\n"
+            
+            await touch_session(session, message_data)
+        except ModelSlotTimeout as e:
+            logging.warning(f"Error streaming message: {str(e)}")
+            yield json.dumps({"error": "Model is busy, please try again later"}) + "\n"
+        except Exception as e:
+            logging.error(f"Error streaming message: {str(e)}")
+            yield json.dumps({"error": "Failed to send message"}) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @api_router.get("/download/{message_id}")
 async def download_message(message_id: str):
     """Download message content (text or image)"""
     try:
-        message = await db.messages.find_one({"id": message_id})
+        with span("mongo.messages.find_one"):
+            message = await db.messages.find_one({"id": message_id})
+        if not message:
+            with span("archive.rehydrate"):
+                rehydrated = await archive_service.rehydrate_by_message(message_id)
+            if rehydrated:
+                with span("mongo.messages.find_one"):
+                    message = await db.messages.find_one({"id": message_id})
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
         
@@ -217,6 +394,9 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Opt-in per-request tracing (X-Trace header or TRACE_SAMPLE_RATE)
+app.add_middleware(RequestTracer)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -232,6 +412,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Background model warm-up, kept referenced so it is not garbage collected
+warmup_task: Optional[asyncio.Task] = None
+
+async def warm_up_models():
+    try:
+        await coordination_service.run_once("job:warmup", hf_service.warm_up, 600)
+    except Exception as e:
+        logging.error(f"Model warm-up failed: {str(e)}")
+
+@app.on_event("startup")
+async def startup():
+    global warmup_task
+    
+    # Runs in every worker: index creation is idempotent, one-off jobs take a lease
+    await ensure_indexes_safely(coordination_service, archive_service)
+    archive_service.start()
+    
+    if os.getenv('WARMUP_ON_STARTUP', '0') == '1':
+        warmup_task = asyncio.create_task(warm_up_models())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if warmup_task is not None:
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+    await archive_service.stop()
     client.close()
\ No newline at end of file
@@ -0,0 +1,276 @@
+import asyncio
+import gzip
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+import bson
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# MongoDB refuses documents above 16 MB, keep some headroom for metadata
+MAX_ARCHIVE_PAYLOAD_BYTES = 15 * 1024 * 1024
+
+class ArchiveService:
+    """Moves cold sessions out of the hot collections into `archived_sessions`.
+
+    Each archived session is stored as a single document holding the session
+    metadata in plain form and all of its messages as one compressed BSON blob.
+    Archived sessions are rehydrated back into `sessions`/`messages` when they
+    are opened or messaged again.
+    """
+
+    def __init__(self, db, coordination=None):
+        self.db = db
+        self.coordination = coordination
+        self.archive_after_days = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+        self.interval_seconds = int(os.getenv('ARCHIVE_INTERVAL_SECONDS', '3600'))
+        self.batch_size = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))
+        self.claim_ttl_seconds = int(os.getenv('ARCHIVE_CLAIM_TTL_SECONDS', '600'))
+        self.codec = os.getenv('ARCHIVE_COMPRESSION', 'zstd' if zstandard else 'gzip')
+        self._task: Optional[asyncio.Task] = None
+
+        if self.codec == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, falling back to gzip for archives")
+            self.codec = 'gzip'
+        if self.codec not in ('zstd', 'gzip'):
+            raise ValueError(f"Unsupported ARCHIVE_COMPRESSION: {self.codec}")
+
+    # Compression helpers
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    @staticmethod
+    def _decompress(data: bytes, codec: str) -> bytes:
+        if codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd-compressed archives")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    # Lifecycle
+    async def ensure_indexes(self):
+        """Create the indexes used by the archiver and by rehydration lookups"""
+        await self.db.sessions.create_index("updated_at")
+        await self.db.archived_sessions.create_index("id", unique=True)
+        await self.db.archived_sessions.create_index("message_ids")
+        await self.db.archived_sessions.create_index([("session.updated_at", -1)])
+
+    def start(self):
+        """Start the periodic archiver in the background"""
+        if self.archive_after_days <= 0:
+            logger.info("Session archiving disabled (ARCHIVE_AFTER_DAYS <= 0)")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await self._archive_cycle()
+                if archived:
+                    logger.info(f"Archived {archived} cold sessions")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session archiving error: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    # Archiving
+    async def _archive_cycle(self) -> int:
+        if self.coordination is None:
+            return await self.archive_cold_sessions()
+        # With several workers only the lease holder archives, for as long as it can renew
+        async with self.coordination.hold("job:archiver") as lease:
+            if lease is None:
+                return 0
+            return await self.archive_cold_sessions(should_stop=lease.done)
+
+    async def archive_cold_sessions(self, should_stop: Callable[[], bool] = lambda: False) -> int:
+        """Archive sessions not updated for `archive_after_days`, return the count"""
+        cutoff = datetime.utcnow() - timedelta(days=self.archive_after_days)
+        archived = 0
+
+        for _ in range(self.batch_size):
+            if should_stop():
+                logger.warning("Lost the archiver lease, stopping this cycle")
+                break
+            session = await self._claim_cold_session(cutoff)
+            if session is None:
+                break
+            if await self.archive_session(session, cutoff):
+                archived += 1
+
+        return archived
+
+    async def _claim_cold_session(self, cutoff: datetime) -> Optional[dict]:
+        """Atomically mark one cold session as being archived by this archiver"""
+        now = datetime.utcnow()
+        return await self.db.sessions.find_one_and_update(
+            {"$and": [
+                {"updated_at": {"$lt": cutoff}},
+                # Recently opened archives are hot again even though nobody wrote to them
+                {"$or": [{"rehydrated_at": {"$exists": False}}, {"rehydrated_at": {"$lt": cutoff}}]},
+                {"archive_skipped_at": {"$exists": False}},
+                # A claim left behind by a crashed archiver can be taken over once expired
+                {"$or": [{"archiving_until": {"$exists": False}}, {"archiving_until": {"$lt": now}}]}
+            ]},
+            {"$set": {
+                "archiving": uuid.uuid4().hex,
+                "archiving_until": now + timedelta(seconds=self.claim_ttl_seconds)
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _release_claim(self, session_id: str, claim: str, update: Optional[dict] = None):
+        await self.db.sessions.update_one(
+            {"id": session_id, "archiving": claim},
+            {"$unset": {"archiving": "", "archiving_until": ""}, **(update or {})}
+        )
+
+    async def archive_session(self, session: dict, cutoff: datetime) -> bool:
+        """Archive one claimed session, returns False if it was skipped"""
+        session_id = session["id"]
+        claim = session["archiving"]
+        for field in ("_id", "archiving", "archiving_until", "rehydrated_at", "archive_skipped_at"):
+            session.pop(field, None)
+
+        for attempt in range(2):
+            messages_cursor = self.db.messages.find({"session_id": session_id}, {"_id": 0}).sort("timestamp", 1)
+            messages = await messages_cursor.to_list(None)
+
+            payload = self._compress(bson.encode({"messages": messages}))
+            if len(payload) > MAX_ARCHIVE_PAYLOAD_BYTES:
+                logger.warning(f"Session {session_id} is too large to archive ({len(payload)} bytes compressed)")
+                # Sessions only grow, keep it out of future cycles
+                await self._release_claim(session_id, claim, {"$set": {"archive_skipped_at": datetime.utcnow()}})
+                return False
+
+            message_ids = [message["id"] for message in messages]
+            try:
+                # An archive written under another claim collides on the unique id index
+                await self.db.archived_sessions.replace_one(
+                    {"id": session_id, "claim": claim},
+                    {
+                        "id": session_id,
+                        "claim": claim,
+                        "session": session,
+                        "codec": self.codec,
+                        "messages": bson.Binary(payload),
+                        "message_ids": message_ids,
+                        "message_count": len(messages),
+                        "archived_at": datetime.utcnow()
+                    },
+                    upsert=True
+                )
+                break
+            except DuplicateKeyError:
+                if attempt or not await self._recover_stale_archive(session_id, claim):
+                    # Keep our claim until it expires so this cycle doesn't pick the session again
+                    logger.warning(f"Session {session_id} already has an archive from another archiver")
+                    return False
+
+        # Messages go before the session: while the hot session exists nobody
+        # rehydrates it, so a rehydration can't race with this delete. Deleting
+        # by id keeps messages written concurrently in the hot collection.
+        await self.db.messages.delete_many({"id": {"$in": message_ids}})
+
+        # Only drop the hot session if we still own it and nobody touched it meanwhile
+        result = await self.db.sessions.delete_one(
+            {"id": session_id, "archiving": claim, "updated_at": {"$lt": cutoff}}
+        )
+        if result.deleted_count == 0:
+            if await self.db.sessions.find_one({"id": session_id}, {"_id": 1}):
+                # Still hot, so the session was touched or reclaimed: put the messages back
+                # and undo our archive only
+                await self._restore_messages(messages)
+                await self.db.archived_sessions.delete_one({"id": session_id, "claim": claim})
+                await self._release_claim(session_id, claim)
+            return False
+
+        return True
+
+    async def _recover_stale_archive(self, session_id: str, claim: str) -> bool:
+        """Undo an archive left behind by an archiver that lost its claim mid-way
+
+        Only the current claim holder recovers. The stale archive's messages go
+        back to the hot collection, since that archiver may already have
+        deleted them there, and the archive is dropped so ours can replace it.
+        """
+        if not await self.db.sessions.find_one({"id": session_id, "archiving": claim}, {"_id": 1}):
+            return False
+
+        archive = await self.db.archived_sessions.find_one({"id": session_id})
+        if archive is None:
+            return True
+
+        raw = self._decompress(bytes(archive["messages"]), archive.get("codec", "gzip"))
+        await self._restore_messages(bson.decode(raw)["messages"])
+        await self.db.archived_sessions.delete_one({"id": session_id, "claim": archive.get("claim")})
+        logger.info(f"Recovered stale archive of session {session_id}")
+        return True
+
+    async def _restore_messages(self, messages: List[dict]):
+        # Upserts keep this idempotent if two requests race on the same session
+        if messages:
+            await self.db.messages.bulk_write(
+                [ReplaceOne({"id": message["id"]}, message, upsert=True) for message in messages],
+                ordered=False
+            )
+
+    # Rehydration
+    async def rehydrate(self, session_id: str) -> Optional[dict]:
+        """Move an archived session back to the hot collections, returns the session"""
+        archive = await self.db.archived_sessions.find_one({"id": session_id})
+        if not archive:
+            return None
+
+        raw = self._decompress(bytes(archive["messages"]), archive.get("codec", "gzip"))
+        messages = bson.decode(raw)["messages"]
+
+        await self._restore_messages(messages)
+        session = archive["session"]
+        # Without this the next cycle would archive the session again right away
+        session["rehydrated_at"] = datetime.utcnow()
+        await self.db.sessions.replace_one({"id": session_id}, session, upsert=True)
+        await self.db.archived_sessions.delete_one({"id": session_id})
+
+        logger.info(f"Rehydrated archived session {session_id} ({len(messages)} messages)")
+        return session
+
+    async def rehydrate_by_message(self, message_id: str) -> bool:
+        """Rehydrate the archived session containing `message_id`, if any"""
+        archive = await self.db.archived_sessions.find_one({"message_ids": message_id}, {"id": 1})
+        if not archive:
+            return False
+        return await self.rehydrate(archive["id"]) is not None
+
+    async def get_archived_sessions(self, limit: int) -> List[dict]:
+        """Return archived session metadata, newest first"""
+        archives_cursor = self.db.archived_sessions.find({}, {"session": 1}).sort("session.updated_at", -1)
+        archives = await archives_cursor.to_list(limit)
+        return [archive["session"] for archive in archives]
+
+    async def delete(self, session_id: str) -> bool:
+        result = await self.db.archived_sessions.delete_one({"id": session_id})
+        return result.deleted_count > 0
@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import uuid
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+class ModelSlotTimeout(Exception):
+    """No global slot for a model became free within MODEL_SLOT_TIMEOUT_SECONDS"""
+
+class CoordinationService:
+    """Cross-worker coordination backed by MongoDB.
+
+    Leases in `leases` implement global per-model concurrency slots and
+    singleton jobs (archiving, warm-up). Documents in `inflight_generations`
+    let identical generations running on different workers or hosts share a
+    single upstream request. Model slots (MODEL_MAX_CONCURRENCY) and
+    deduplication (GENERATION_DEDUP=1) are both off unless configured.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.model_max_concurrency = int(os.getenv('MODEL_MAX_CONCURRENCY', '0'))
+        self.model_slot_timeout = float(os.getenv('MODEL_SLOT_TIMEOUT_SECONDS', '120'))
+        self.max_poll_interval = float(os.getenv('COORDINATION_MAX_POLL_SECONDS', '5'))
+        self.dedup_enabled = os.getenv('GENERATION_DEDUP', '0') == '1'
+        self.lease_ttl_seconds = int(os.getenv('LEASE_TTL_SECONDS', '300'))
+        self.poll_interval = float(os.getenv('COORDINATION_POLL_SECONDS', '0.5'))
+        # Finished runs are kept this long for callers still polling them, new callers never read them
+        self.dedup_result_ttl_seconds = int(os.getenv('DEDUP_RESULT_TTL_SECONDS', '30'))
+
+    async def ensure_indexes(self):
+        """Create coordination indexes, safe to run from every worker at once"""
+        await self.db.inflight_generations.create_index("expires_at", expireAfterSeconds=0)
+        await self.db.inflight_generations.create_index([("key", 1), ("generation", -1)])
+        await self.db.leases.create_index("expires_at", expireAfterSeconds=3600)
+
+    # Leases
+    async def try_acquire(self, name: str, ttl_seconds: Optional[int] = None) -> Optional[str]:
+        """Take the lease `name` if it is free or expired, returns the holder token"""
+        token = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl_seconds or self.lease_ttl_seconds)
+        try:
+            # Matches only a missing or expired lease, a live one makes the upsert collide on _id
+            await self.db.leases.update_one(
+                {"_id": name, "expires_at": {"$lt": now}},
+                {"$set": {"holder": token, "expires_at": expires_at}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return None
+        return token
+
+    async def renew(self, name: str, token: str, ttl_seconds: Optional[int] = None) -> bool:
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds or self.lease_ttl_seconds)
+        result = await self.db.leases.update_one(
+            {"_id": name, "holder": token},
+            {"$set": {"expires_at": expires_at}}
+        )
+        return result.matched_count > 0
+
+    async def release(self, name: str, token: str):
+        await self.db.leases.delete_one({"_id": name, "holder": token})
+
+    async def _keep_alive(self, name: str, token: str):
+        while True:
+            await asyncio.sleep(self.lease_ttl_seconds / 3)
+            if not await self.renew(name, token):
+                logger.warning(f"Lost lease {name}")
+                return
+
+    @asynccontextmanager
+    async def hold(self, name: str):
+        """Hold the lease `name` with renewal, yields the keep-alive task or None if taken
+
+        The keep-alive task finishes as soon as a renewal fails, callers doing
+        long work should check it and stop.
+        """
+        token = await self.try_acquire(name)
+        if not token:
+            yield None
+            return
+
+        keep_alive = asyncio.create_task(self._keep_alive(name, token))
+        try:
+            yield keep_alive
+        finally:
+            keep_alive.cancel()
+            await self.release(name, token)
+
+    @asynccontextmanager
+    async def model_slot(self, model: str):
+        """Hold one of the MODEL_MAX_CONCURRENCY global slots for `model`"""
+        if self.model_max_concurrency <= 0:
+            yield
+            return
+
+        with span("coordination.model_slot"):
+            name, token = await self._acquire_any_slot(model)
+
+        keep_alive = asyncio.create_task(self._keep_alive(name, token))
+        try:
+            yield
+        finally:
+            keep_alive.cancel()
+            await self.release(name, token)
+
+    async def _acquire_any_slot(self, model: str):
+        deadline = asyncio.get_running_loop().time() + self.model_slot_timeout
+        delay = self.poll_interval
+        while True:
+            # Start at a random slot so waiters don't all fight over slot 0
+            offset = random.randrange(self.model_max_concurrency)
+            for index in range(self.model_max_concurrency):
+                name = f"model:{model}:{(offset + index) % self.model_max_concurrency}"
+                token = await self.try_acquire(name)
+                if token:
+                    return name, token
+
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                raise ModelSlotTimeout(f"No free slot for {model} after {self.model_slot_timeout:.0f} seconds")
+            # Exponential backoff with full jitter
+            await asyncio.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, self.max_poll_interval)
+
+    # In-flight deduplication
+    @staticmethod
+    def generation_key(*parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    async def dedup(self, key: str, producer: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `producer` once across all workers for concurrent calls with the same key
+
+        Each run of a key is its own entry, numbered by `generation`. Callers
+        join the latest run while it is pending; a finished or abandoned run
+        makes them start the next one and is left alone for its own waiters.
+        """
+        if not self.dedup_enabled:
+            return await producer()
+        
+        while True:
+            latest = await self.db.inflight_generations.find_one({"key": key}, sort=[("generation", -1)])
+            if latest and latest["status"] == "pending" and latest["expires_at"] >= datetime.utcnow():
+                with span("coordination.dedup_wait"):
+                    done, result = await self._wait_for_result(latest["_id"])
+                if done:
+                    return result
+                # The owner died, start or join the next run
+                continue
+
+            generation = latest["generation"] + 1 if latest else 1
+            entry_id = f"{key}:{generation}"
+            try:
+                await self.db.inflight_generations.insert_one({
+                    "_id": entry_id,
+                    "key": key,
+                    "generation": generation,
+                    "status": "pending",
+                    "owner": self.worker_id,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.lease_ttl_seconds)
+                })
+            except DuplicateKeyError:
+                # Another caller started this run first, join it
+                continue
+
+            return await self._produce(entry_id, producer)
+
+    async def _produce(self, entry_id: str, producer: Callable[[], Awaitable[Any]]) -> Any:
+        keep_alive = asyncio.create_task(self._keep_pending(entry_id))
+        try:
+            result = await producer()
+        except BaseException:
+            await self.db.inflight_generations.delete_one({"_id": entry_id, "owner": self.worker_id})
+            raise
+        finally:
+            keep_alive.cancel()
+
+        await self.db.inflight_generations.update_one(
+            {"_id": entry_id, "owner": self.worker_id},
+            {"$set": {
+                "status": "done",
+                "result": result,
+                "expires_at": datetime.utcnow() + timedelta(seconds=self.dedup_result_ttl_seconds)
+            }}
+        )
+        return result
+
+    async def _keep_pending(self, entry_id: str):
+        # Upstream retries can outlast the lease, keep waiters from taking over
+        while True:
+            await asyncio.sleep(self.lease_ttl_seconds / 3)
+            await self.db.inflight_generations.update_one(
+                {"_id": entry_id, "owner": self.worker_id, "status": "pending"},
+                {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=self.lease_ttl_seconds)}}
+            )
+
+    async def _wait_for_result(self, entry_id: str):
+        """Poll a run owned by another caller, returns (done, result)"""
+        while True:
+            entry = await self.db.inflight_generations.find_one({"_id": entry_id})
+            if entry is None:
+                # The owner failed and removed its entry
+                return False, None
+
+            if entry["status"] == "done":
+                return True, entry.get("result")
+
+            if entry["expires_at"] < datetime.utcnow():
+                # The owner stopped renewing
+                return False, None
+
+            await asyncio.sleep(self.poll_interval)
+
+    # Startup
+    async def run_once(self, name: str, job: Callable[[], Awaitable[Any]], ttl_seconds: int):
+        """Run `job` on only one worker per `ttl_seconds` window"""
+        token = await self.try_acquire(name, ttl_seconds)
+        if not token:
+            return False
+        await job()
+        return True
+
+async def ensure_indexes_safely(*services):
+    """Create indexes for all services, tolerating concurrent creation from other workers"""
+    for service in services:
+        try:
+            await service.ensure_indexes()
+        except OperationFailure as e:
+            logger.warning(f"Index creation for {type(service).__name__} failed: {str(e)}")
@@ -2,23 +2,34 @@ import httpx
 import os
 import base64
 import asyncio
-from typing import Optional
+from contextlib import nullcontext
+from typing import AsyncContextManager, Callable, Optional
 import logging
 
+from services.tracing import span
+
 logger = logging.getLogger(__name__)
 
 class HuggingFaceService:
-    def __init__(self):
+    def __init__(self, model_slot: Optional[Callable[[str], AsyncContextManager]] = None):
         self.api_key = os.getenv('HUGGINGFACE_API_KEY')
         self.llama_model = os.getenv('LLAMA_MODEL', 'meta-llama/Llama-2-7b-chat-hf')
         self.stable_diffusion_model = os.getenv('STABLE_DIFFUSION_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0')
         self.base_url = "https://api-inference.huggingface.co/models"
+        # Caps concurrent image requests sent upstream by this process
+        self.image_semaphore = asyncio.Semaphore(int(os.getenv('IMAGE_MAX_CONCURRENCY', '4')))
+        # Global admission per model (e.g. CoordinationService.model_slot), taken after the local queue
+        self.model_slot = model_slot or (lambda model: nullcontext())
         
         if not self.api_key:
             raise ValueError("HUGGINGFACE_API_KEY environment variable is required")
     
     async def generate_text(self, prompt: str, max_retries: int = 3) -> str:
         """Generate text using Llama model"""
+        async with self.model_slot(self.llama_model):
+            return await self._generate_text(prompt, max_retries)
+    
+    async def _generate_text(self, prompt: str, max_retries: int) -> str:
         url = f"{self.base_url}/{self.llama_model}"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -42,13 +53,15 @@ class HuggingFaceService:
         for attempt in range(max_retries):
             try:
                 async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(url, json=payload, headers=headers)
+                    with span("hf.text.attempt"):
+                        response = await client.post(url, json=payload, headers=headers)
                     
                     if response.status_code == 503:
                         # Model is loading, wait and retry
                         wait_time = 20 * (attempt + 1)
                         logger.info(f"Model loading, waiting {wait_time} seconds...")
-                        await asyncio.sleep(wait_time)
+                        with span("hf.loading_wait"):
+                            await asyncio.sleep(wait_time)
                         continue
                     
                     if response.status_code == 200:
@@ -64,12 +77,42 @@ class HuggingFaceService:
                 logger.error(f"Text generation error (attempt {attempt + 1}): {str(e)}")
                 if attempt == max_retries - 1:
                     break
-                await asyncio.sleep(5)
+                with span("hf.retry_wait"):
+                    await asyncio.sleep(5)
         
         return "Maaf, terjadi kesalahan saat menghasilkan respons. Silakan coba lagi."
     
-    async def generate_image(self, prompt: str, max_retries: int = 3) -> Optional[str]:
+    async def warm_up(self):
+        """Send a tiny request so the text model is loaded before real traffic arrives"""
+        logger.info(f"Warming up {self.llama_model}")
+        await self.generate_text("Halo", max_retries=1)
+    
+    async def generate_image(
+        self,
+        prompt: str,
+        max_retries: int = 3,
+        seed: Optional[int] = None,
+        guidance_scale: Optional[float] = None,
+        num_inference_steps: Optional[int] = None
+    ) -> Optional[str]:
         """Generate image using Stable Diffusion model and return base64 string"""
+        with span("hf.image.queue"):
+            await self.image_semaphore.acquire()
+        try:
+            # Only hold a global slot once this process is ready to send the request
+            async with self.model_slot(self.stable_diffusion_model):
+                return await self._generate_image(prompt, max_retries, seed, guidance_scale, num_inference_steps)
+        finally:
+            self.image_semaphore.release()
+    
+    async def _generate_image(
+        self,
+        prompt: str,
+        max_retries: int,
+        seed: Optional[int],
+        guidance_scale: Optional[float],
+        num_inference_steps: Optional[int]
+    ) -> Optional[str]:
         url = f"{self.base_url}/{self.stable_diffusion_model}"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -79,21 +122,25 @@ class HuggingFaceService:
         payload = {
             "inputs": prompt,
             "parameters": {
-                "guidance_scale": 7.5,
-                "num_inference_steps": 20
+                "guidance_scale": guidance_scale if guidance_scale is not None else 7.5,
+                "num_inference_steps": num_inference_steps if num_inference_steps is not None else 20
             }
         }
+        if seed is not None:
+            payload["parameters"]["seed"] = seed
         
         for attempt in range(max_retries):
             try:
                 async with httpx.AsyncClient(timeout=120.0) as client:
-                    response = await client.post(url, json=payload, headers=headers)
+                    with span("hf.image.attempt"):
+                        response = await client.post(url, json=payload, headers=headers)
                     
                     if response.status_code == 503:
                         # Model is loading, wait and retry
                         wait_time = 30 * (attempt + 1)
                         logger.info(f"Image model loading, waiting {wait_time} seconds...")
-                        await asyncio.sleep(wait_time)
+                        with span("hf.loading_wait"):
+                            await asyncio.sleep(wait_time)
                         continue
                     
                     if response.status_code == 200:
@@ -108,6 +155,7 @@ class HuggingFaceService:
                 logger.error(f"Image generation error (attempt {attempt + 1}): {str(e)}")
                 if attempt == max_retries - 1:
                     break
-                await asyncio.sleep(10)
+                with span("hf.retry_wait"):
+                    await asyncio.sleep(10)
         
         return None
\ No newline at end of file
@@ -0,0 +1,136 @@
+import os
+import json
+import random
+import logging
+import contextvars
+from contextlib import contextmanager
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # profiling is optional
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "x-trace"
+
+class Trace:
+    """Spans recorded while handling one request"""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def add(self, name: str, start: float, end: float):
+        self.spans.append((name, start - self.start, end - start))
+
+    def server_timing(self, total: float) -> str:
+        """Aggregate spans per name into a Server-Timing header value"""
+        totals = {}
+        counts = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+            counts[name] = counts.get(name, 0) + 1
+
+        entries = [
+            f'{name};dur={totals[name] * 1000:.1f};desc="{counts[name]}x"'
+            for name in totals
+        ]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> List[dict]:
+        return [
+            {"name": name, "offset_ms": round(offset * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+            for name, offset, duration in self.spans
+        ]
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+@contextmanager
+def span(name: str):
+    """Record the duration of the enclosed block on the current request trace, if any"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, perf_counter())
+
+class RequestTracer:
+    """ASGI middleware enabling tracing per request via the X-Trace header or sampling.
+
+    `X-Trace: 1` traces a request. Traced responses carry a Server-Timing
+    header and traces slower than TRACE_SLOW_MS are logged. Sampled requests
+    run under a sampling profiler with TRACE_PROFILE=1, header-triggered ones
+    (`X-Trace: profile`) only with TRACE_ALLOW_PROFILE_HEADER=1; both require
+    pyinstrument. Untraced requests are passed straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+        self.slow_ms = float(os.getenv('TRACE_SLOW_MS', '5000'))
+        self.profile_sampled = os.getenv('TRACE_PROFILE', '0') == '1'
+        self.allow_profile_header = os.getenv('TRACE_ALLOW_PROFILE_HEADER', '0') == '1'
+
+        if (self.profile_sampled or self.allow_profile_header) and Profiler is None:
+            logger.warning("Request profiling is enabled but pyinstrument is not installed, profiling disabled")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = Headers(scope=scope).get(TRACE_HEADER, "").lower()
+        requested = header in ("1", "true", "profile")
+        sampled = not requested and self.sample_rate > 0 and random.random() < self.sample_rate
+        if not requested and not sampled:
+            return await self.app(scope, receive, send)
+
+        profiler = None
+        if Profiler is not None and (
+            (header == "profile" and self.allow_profile_header) or self.profile_sampled
+        ):
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+
+        trace = Trace()
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Streaming responses are only timed until their headers are sent
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", trace.server_timing(perf_counter() - trace.start))
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            if profiler is not None:
+                profiler.stop()
+
+        total = perf_counter() - trace.start
+        if total * 1000 >= self.slow_ms or requested:
+            log = logger.warning if total * 1000 >= self.slow_ms else logger.info
+            log("Request trace: " + json.dumps({
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "total_ms": round(total * 1000, 1),
+                "spans": trace.to_dict()
+            }))
+            if profiler is not None:
+                log(f"Request profile for {scope['method']} {scope['path']}:\n{profiler.output_text()}")
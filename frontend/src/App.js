@@ -11,6 +11,25 @@ import { Bot, Menu, X } from 'lucide-react';
 import { Button } from './components/ui/button';
 import { Card } from './components/ui/card';
 
+// Collapse image variants sharing a group_id into one entry, in variant order
+const groupVariants = (messages) => {
+  const groups = [];
+  const byGroupId = {};
+  messages.forEach((message) => {
+    if (message.group_id && byGroupId[message.group_id]) {
+      byGroupId[message.group_id].push(message);
+      byGroupId[message.group_id].sort((a, b) => (a.variant_index ?? 0) - (b.variant_index ?? 0));
+      return;
+    }
+    const group = [message];
+    if (message.group_id) {
+      byGroupId[message.group_id] = group;
+    }
+    groups.push(group);
+  });
+  return groups;
+};
+
 const ChatInterface = () => {
   const [sessions, setSessions] = useState([]);
   const [activeSessionId, setActiveSessionId] = useState(null);
@@ -79,7 +98,7 @@ const ChatInterface = () => {
     }
   };
 
-  const handleSendMessage = async (content, type) => {
+  const handleSendMessage = async (content, type, options = {}) => {
     if (!activeSessionId) {
       await handleNewSession();
       return;
@@ -88,8 +107,22 @@ const ChatInterface = () => {
     setIsLoading(true);
     
     try {
-      // Send message and get AI response
-      const aiResponse = await chatAPI.sendMessage(activeSessionId, content, type);
+      if (type === 'image') {
+        // Show the prompt right away and each image variant as soon as it is ready
+        setMessages(prev => [...prev, {
+          id: `pending-${Date.now()}`,
+          type: 'user',
+          content,
+          content_type: 'text',
+          timestamp: new Date().toISOString()
+        }]);
+        await chatAPI.streamMessage(activeSessionId, content, type, options, (aiMessage) => {
+          setMessages(prev => [...prev, aiMessage]);
+        });
+      } else {
+        // Send message and get AI response
+        await chatAPI.sendMessage(activeSessionId, content, type);
+      }
       
       // Reload messages to get the latest conversation
       await loadMessages(activeSessionId);
@@ -272,10 +305,11 @@ const ChatInterface = () => {
         <div className="flex-1 overflow-y-auto">
           {messages.length > 0 ? (
             <div className="max-w-4xl mx-auto">
-              {messages.map((message) => (
+              {groupVariants(messages).map((group) => (
                 <ChatMessage
-                  key={message.id}
-                  message={message}
+                  key={group[0].group_id || group[0].id}
+                  message={group[0]}
+                  variants={group}
                   onDownload={handleDownload}
                 />
               ))}
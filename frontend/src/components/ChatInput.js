@@ -9,6 +9,7 @@ const ChatInput = ({ onSendMessage, isLoading }) => {
   const [textMessage, setTextMessage] = useState('');
   const [imagePrompt, setImagePrompt] = useState('');
   const [activeTab, setActiveTab] = useState('text');
+  const [numVariants, setNumVariants] = useState(1);
 
   const handleSubmit = (e) => {
     e.preventDefault();
@@ -18,7 +19,7 @@ const ChatInput = ({ onSendMessage, isLoading }) => {
       onSendMessage(textMessage.trim(), 'text');
       setTextMessage('');
     } else if (activeTab === 'image' && imagePrompt.trim()) {
-      onSendMessage(imagePrompt.trim(), 'image');
+      onSendMessage(imagePrompt.trim(), 'image', { num_variants: numVariants });
       setImagePrompt('');
     }
   };
@@ -65,9 +66,27 @@ const ChatInput = ({ onSendMessage, isLoading }) => {
               className="min-h-[100px] resize-none border-slate-200 focus:border-slate-400 transition-colors"
               disabled={isLoading}
             />
-            <p className="text-xs text-slate-500 mt-2">
-              Contoh: "Pemandangan gunung dengan matahari terbenam, gaya realistis"
-            </p>
+            <div className="flex justify-between items-center mt-2">
+              <p className="text-xs text-slate-500">
+                Contoh: "Pemandangan gunung dengan matahari terbenam, gaya realistis"
+              </p>
+              <div className="flex items-center gap-1">
+                <span className="text-xs text-slate-500 mr-1">Variasi</span>
+                {[1, 2, 3, 4].map((count) => (
+                  <Button
+                    key={count}
+                    type="button"
+                    variant={numVariants === count ? 'default' : 'outline'}
+                    size="sm"
+                    className="h-7 w-7 p-0 text-xs"
+                    onClick={() => setNumVariants(count)}
+                    disabled={isLoading}
+                  >
+                    {count}
+                  </Button>
+                ))}
+              </div>
+            </div>
           </TabsContent>
           
           <div className="flex justify-between items-center">
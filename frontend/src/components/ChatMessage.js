@@ -6,10 +6,11 @@ import { Download, User, Bot, Copy, Check } from 'lucide-react';
 import { useState } from 'react';
 import { chatAPI } from '../services/api';
 
-const ChatMessage = ({ message, onDownload }) => {
+const ChatMessage = ({ message, variants = [message], onDownload }) => {
   const [copied, setCopied] = useState(false);
   const isUser = message.type === 'user';
   const isImage = message.content_type === 'image';
+  const hasVariants = isImage && variants.length > 1;
 
   const handleCopy = async () => {
     if (isImage) return;
@@ -18,12 +19,12 @@ const ChatMessage = ({ message, onDownload }) => {
     setTimeout(() => setCopied(false), 2000);
   };
 
-  const handleDownload = async () => {
+  const handleDownload = async (target = message) => {
     try {
       if (isImage) {
-        await chatAPI.downloadMessage(message.id, `image-${message.id}.png`);
+        await chatAPI.downloadMessage(target.id, `image-${target.id}.png`);
       } else {
-        await chatAPI.downloadMessage(message.id, `message-${message.id}.txt`);
+        await chatAPI.downloadMessage(target.id, `message-${target.id}.txt`);
       }
       onDownload(`File ${isImage ? 'gambar' : 'teks'} berhasil diunduh`);
     } catch (error) {
@@ -56,15 +57,38 @@ const ChatMessage = ({ message, onDownload }) => {
               {message.prompt && (
                 <p className="text-sm text-slate-600 italic">"{message.prompt}"</p>
               )}
-              <div className="relative group">
-                <img 
-                  src={message.content} 
-                  alt={message.prompt || "Generated image"}
-                  className="w-full max-w-lg rounded-lg shadow-sm transition-transform duration-200 hover:scale-[1.02]"
-                  loading="lazy"
-                />
-                <div className="absolute inset-0 bg-black/0 group-hover:bg-black/10 transition-colors duration-200 rounded-lg" />
-              </div>
+              {hasVariants ? (
+                <div className="grid grid-cols-2 gap-3">
+                  {variants.map((variant) => (
+                    <div key={variant.id} className="relative group">
+                      <img 
+                        src={variant.content} 
+                        alt={variant.prompt || "Generated image"}
+                        className="w-full rounded-lg shadow-sm transition-transform duration-200 hover:scale-[1.02]"
+                        loading="lazy"
+                      />
+                      <Button
+                        variant="secondary"
+                        size="sm"
+                        onClick={() => handleDownload(variant)}
+                        className="absolute bottom-2 right-2 h-7 px-2 opacity-0 group-hover:opacity-100 transition-opacity"
+                      >
+                        <Download className="h-4 w-4" />
+                      </Button>
+                    </div>
+                  ))}
+                </div>
+              ) : (
+                <div className="relative group">
+                  <img 
+                    src={message.content} 
+                    alt={message.prompt || "Generated image"}
+                    className="w-full max-w-lg rounded-lg shadow-sm transition-transform duration-200 hover:scale-[1.02]"
+                    loading="lazy"
+                  />
+                  <div className="absolute inset-0 bg-black/0 group-hover:bg-black/10 transition-colors duration-200 rounded-lg" />
+                </div>
+              )}
             </div>
           ) : (
             <p className="whitespace-pre-wrap leading-relaxed">{message.content}</p>
@@ -84,15 +108,17 @@ const ChatMessage = ({ message, onDownload }) => {
             </Button>
           )}
           
-          <Button
-            variant="ghost"
-            size="sm"
-            onClick={handleDownload}
-            className="h-8 px-3 text-slate-500 hover:text-slate-700 transition-colors"
-          >
-            <Download className="h-4 w-4" />
-            <span className="ml-1 text-xs">Unduh</span>
-          </Button>
+          {!hasVariants && (
+            <Button
+              variant="ghost"
+              size="sm"
+              onClick={() => handleDownload()}
+              className="h-8 px-3 text-slate-500 hover:text-slate-700 transition-colors"
+            >
+              <Download className="h-4 w-4" />
+              <span className="ml-1 text-xs">Unduh</span>
+            </Button>
+          )}
         </div>
       </div>
     </div>
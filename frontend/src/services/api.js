@@ -65,6 +65,46 @@ export const chatAPI = {
     return response.data;
   },
 
+  // Streams AI responses (e.g. image variants) and calls onMessage as each one arrives.
+  // options: { num_variants, seeds, guidance_scale, num_inference_steps } for images
+  streamMessage: async (sessionId, content, messageType, options = {}, onMessage = () => {}) => {
+    const response = await fetch(`${API}/sessions/${sessionId}/messages/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ content, message_type: messageType, ...options })
+    });
+    if (!response.ok) {
+      throw new Error(`Stream request failed: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const messages = [];
+    let buffer = '';
+
+    const handleLine = (line) => {
+      if (!line.trim()) return;
+      const data = JSON.parse(line);
+      if (data.error) {
+        throw new Error(data.error);
+      }
+      messages.push(data);
+      onMessage(data);
+    };
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      lines.forEach(handleLine);
+    }
+    handleLine(buffer);
+
+    return messages;
+  },
+
   // Download functionality
   downloadMessage: async (messageId, filename) => {
     const response = await api.get(`/download/${messageId}`, {
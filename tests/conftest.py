@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# Backend modules import each other as top-level packages (`services.*`, `models`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+@pytest.fixture
+def db():
+    """A fresh in-memory Motor database per test"""
+    return AsyncMongoMockClient()["test"]
@@ -0,0 +1,208 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+
+from services.archive_service import ArchiveService
+
+pytestmark = pytest.mark.asyncio
+
+@pytest_asyncio.fixture
+async def service(db):
+    service = ArchiveService(db)
+    await service.ensure_indexes()
+    return service
+
+def archive_cutoff(service):
+    return datetime.utcnow() - timedelta(days=service.archive_after_days)
+
+async def seed_session(db, session_id="s1", age_days=60, message_count=3):
+    updated_at = datetime.utcnow() - timedelta(days=age_days)
+    await db.sessions.insert_one({
+        "id": session_id,
+        "title": "Percakapan lama",
+        "created_at": updated_at,
+        "updated_at": updated_at
+    })
+    for index in range(message_count):
+        await db.messages.insert_one({
+            "id": f"{session_id}-m{index}",
+            "session_id": session_id,
+            "type": "user" if index % 2 == 0 else "assistant",
+            "content": f"pesan {index}",
+            "content_type": "text",
+            "timestamp": updated_at + timedelta(seconds=index)
+        })
+
+async def test_archive_and_rehydrate_round_trip(db, service):
+    await seed_session(db)
+    await seed_session(db, "fresh", age_days=0)
+
+    assert await service.archive_cold_sessions() == 1
+    assert await db.sessions.find_one({"id": "s1"}) is None
+    assert await db.messages.count_documents({"session_id": "s1"}) == 0
+    assert await db.sessions.find_one({"id": "fresh"}) is not None
+
+    archived = await service.get_archived_sessions(10)
+    assert [session["id"] for session in archived] == ["s1"]
+
+    session = await service.rehydrate("s1")
+    assert session["title"] == "Percakapan lama"
+    assert await db.archived_sessions.count_documents({}) == 0
+    messages = await db.messages.find({"session_id": "s1"}).sort("timestamp", 1).to_list(None)
+    assert [message["id"] for message in messages] == ["s1-m0", "s1-m1", "s1-m2"]
+
+    # A freshly opened session is not archived again on the next cycle
+    assert await service.archive_cold_sessions() == 0
+
+async def test_rehydrate_by_message_id(db, service):
+    await seed_session(db)
+    await service.archive_cold_sessions()
+
+    assert await service.rehydrate_by_message("s1-m1") is True
+    assert await db.messages.find_one({"id": "s1-m1"}) is not None
+    assert await service.rehydrate_by_message("missing") is False
+
+async def test_session_touched_while_archiving_stays_hot(db, service):
+    await seed_session(db)
+    cutoff = archive_cutoff(service)
+    session = await service._claim_cold_session(cutoff)
+
+    # A message arrives between the claim and the hot delete
+    await db.sessions.update_one({"id": "s1"}, {"$set": {"updated_at": datetime.utcnow()}})
+
+    assert await service.archive_session(session, cutoff) is False
+    assert await db.archived_sessions.count_documents({}) == 0
+    hot = await db.sessions.find_one({"id": "s1"})
+    assert "archiving" not in hot
+    assert await db.messages.count_documents({"session_id": "s1"}) == 3
+
+async def test_claimed_session_is_not_archived_twice(db, service):
+    other = ArchiveService(db)
+    await seed_session(db)
+    cutoff = archive_cutoff(service)
+    session = await service._claim_cold_session(cutoff)
+    assert await other._claim_cold_session(cutoff) is None
+
+    assert await service.archive_session(session, cutoff) is True
+
+    # A stale archiver replaying the same session cannot overwrite the archive
+    stale = {"id": "s1", "title": "Percakapan lama", "archiving": "stale"}
+    assert await other.archive_session(stale, cutoff) is False
+    archives = await db.archived_sessions.find({"id": "s1"}).to_list(None)
+    assert [archive["message_count"] for archive in archives] == [3]
+
+async def test_oversized_session_is_skipped_once(db, service, monkeypatch):
+    monkeypatch.setattr("services.archive_service.MAX_ARCHIVE_PAYLOAD_BYTES", 1)
+    await seed_session(db)
+
+    assert await service.archive_cold_sessions() == 0
+    hot = await db.sessions.find_one({"id": "s1"})
+    assert "archive_skipped_at" in hot
+    assert "archiving" not in hot
+    assert await service._claim_cold_session(archive_cutoff(service)) is None
+
+@pytest.fixture
+def after_archiver_deletes_messages(db, monkeypatch):
+    """Run a hook once, right after the archiver drops the hot messages"""
+    collection_class = type(db.messages)
+    original = collection_class.delete_many
+    hooks = []
+
+    async def delete_many(self, filter, *args, **kwargs):
+        result = await original(self, filter, *args, **kwargs)
+        if hooks and "$in" in filter.get("id", {}):
+            await hooks.pop()()
+        return result
+
+    monkeypatch.setattr(collection_class, "delete_many", delete_many)
+    return hooks.append
+
+async def test_message_sent_mid_archive_keeps_all_messages(db, service, after_archiver_deletes_messages):
+    await seed_session(db)
+
+    async def send_message():
+        await db.messages.insert_one({"id": "s1-new", "session_id": "s1", "timestamp": datetime.utcnow()})
+        await db.sessions.update_one({"id": "s1"}, {"$set": {"updated_at": datetime.utcnow()}})
+
+    after_archiver_deletes_messages(send_message)
+
+    assert await service.archive_cold_sessions() == 0
+    assert await db.archived_sessions.count_documents({}) == 0
+    assert await db.sessions.find_one({"id": "s1"}) is not None
+    assert await db.messages.count_documents({"session_id": "s1"}) == 4
+
+async def test_rehydrate_mid_archive_keeps_all_messages(db, service, after_archiver_deletes_messages):
+    await seed_session(db)
+    after_archiver_deletes_messages(lambda: service.rehydrate("s1"))
+
+    assert await service.archive_cold_sessions() == 0
+    assert await db.archived_sessions.count_documents({}) == 0
+    assert await db.sessions.find_one({"id": "s1"}) is not None
+    assert await db.messages.count_documents({"session_id": "s1"}) == 3
+
+    # The session still archives and rehydrates cleanly afterwards
+    await db.sessions.update_one({"id": "s1"}, {"$unset": {"rehydrated_at": ""}})
+    assert await service.archive_cold_sessions() == 1
+    await service.rehydrate("s1")
+    assert await db.messages.count_documents({"session_id": "s1"}) == 3
+
+async def crash_archiver_after_archive_write(db, service, monkeypatch, delete_messages):
+    """Leave behind the state of an archiver that died after writing its archive"""
+    collection_class = type(db.messages)
+    original = collection_class.delete_many
+
+    async def crashing_delete_many(self, filter, *args, **kwargs):
+        if delete_messages:
+            await original(self, filter, *args, **kwargs)
+        raise RuntimeError("archiver crashed")
+
+    cutoff = archive_cutoff(service)
+    session = await service._claim_cold_session(cutoff)
+    assert session["id"] == "s1"
+    with monkeypatch.context() as patch:
+        patch.setattr(collection_class, "delete_many", crashing_delete_many)
+        with pytest.raises(RuntimeError):
+            await service.archive_session(session, cutoff)
+
+    # Its claim has expired by the time the next archiver runs
+    await db.sessions.update_one(
+        {"id": session["id"]},
+        {"$set": {"archiving_until": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+
+@pytest.mark.parametrize("delete_messages", [False, True])
+async def test_archive_left_by_crashed_archiver_is_recovered(db, service, monkeypatch, delete_messages):
+    await seed_session(db)
+    await seed_session(db, "s2")
+    await crash_archiver_after_archive_write(db, service, monkeypatch, delete_messages)
+
+    assert await service.archive_cold_sessions() == 2
+    assert await db.sessions.count_documents({}) == 0
+    archives = await db.archived_sessions.find({"id": "s1"}).to_list(None)
+    assert [archive["message_count"] for archive in archives] == [3]
+
+    await service.rehydrate("s1")
+    assert await db.messages.count_documents({"session_id": "s1"}) == 3
+
+async def test_unrecoverable_archive_is_not_retried_in_the_same_cycle(db, service, monkeypatch):
+    await seed_session(db)
+    await seed_session(db, "s2")
+    await crash_archiver_after_archive_write(db, service, monkeypatch, delete_messages=False)
+
+    async def refuse(session_id, claim):
+        return False
+
+    monkeypatch.setattr(service, "_recover_stale_archive", refuse)
+    calls = []
+    archive_session = service.archive_session
+
+    async def counting_archive_session(session, cutoff):
+        calls.append(session["id"])
+        return await archive_session(session, cutoff)
+
+    monkeypatch.setattr(service, "archive_session", counting_archive_session)
+
+    assert await service.archive_cold_sessions() == 1
+    assert sorted(calls) == ["s1", "s2"]
+    assert await db.messages.count_documents({"session_id": "s1"}) == 3
@@ -0,0 +1,171 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.coordination_service import CoordinationService, ModelSlotTimeout
+from services.huggingface_service import HuggingFaceService
+
+pytestmark = pytest.mark.asyncio
+
+def make_worker(db):
+    worker = CoordinationService(db)
+    worker.dedup_enabled = True
+    worker.poll_interval = 0.01
+    return worker
+
+@pytest.fixture
+def first(db):
+    return make_worker(db)
+
+@pytest.fixture
+def second(db):
+    return make_worker(db)
+
+async def test_lease_is_exclusive_until_released(first, second):
+    token = await first.try_acquire("job:archiver")
+    assert token
+    assert await second.try_acquire("job:archiver") is None
+
+    await first.release("job:archiver", token)
+    assert await second.try_acquire("job:archiver")
+
+async def test_expired_lease_is_taken_over(db, first, second):
+    token = await first.try_acquire("job:archiver")
+    await db.leases.update_one(
+        {"_id": "job:archiver"},
+        {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+
+    assert await second.try_acquire("job:archiver")
+    # The previous holder notices on its next renewal
+    assert await first.renew("job:archiver", token) is False
+
+async def test_hold_yields_none_when_lease_is_taken(first, second):
+    async with first.hold("job:archiver") as lease:
+        assert lease is not None
+        async with second.hold("job:archiver") as other:
+            assert other is None
+    async with second.hold("job:archiver") as lease:
+        assert lease is not None
+
+async def test_concurrent_waiter_shares_the_owner_result(first, second):
+    calls = []
+    release = asyncio.Event()
+
+    async def produce(name):
+        calls.append(name)
+        await release.wait()
+        return f"hasil dari {name}"
+
+    owner_task = asyncio.create_task(first.dedup("key", lambda: produce("owner")))
+    await asyncio.sleep(0.05)
+    waiter_task = asyncio.create_task(second.dedup("key", lambda: produce("waiter")))
+    await asyncio.sleep(0.05)
+    release.set()
+
+    assert await owner_task == "hasil dari owner"
+    assert await waiter_task == "hasil dari owner"
+    assert calls == ["owner"]
+
+async def test_late_caller_does_not_disturb_earlier_waiters(db, first, second):
+    late = make_worker(db)
+    # The waiter polls slowly enough for the late caller to arrive in between
+    second.poll_interval = 0.2
+    calls = []
+    release = asyncio.Event()
+
+    async def produce(name):
+        calls.append(name)
+        if name == "owner":
+            await release.wait()
+        return f"hasil dari {name}"
+
+    owner_task = asyncio.create_task(first.dedup("key", lambda: produce("owner")))
+    await asyncio.sleep(0.05)
+    waiter_task = asyncio.create_task(second.dedup("key", lambda: produce("waiter")))
+    await asyncio.sleep(0.05)
+    release.set()
+    assert await owner_task == "hasil dari owner"
+
+    assert await late.dedup("key", lambda: produce("late")) == "hasil dari late"
+    assert await waiter_task == "hasil dari owner"
+    assert calls == ["owner", "late"]
+
+async def test_finished_generation_is_not_served_to_late_callers(first, second):
+    async def produce(name):
+        return f"hasil dari {name}"
+
+    assert await first.dedup("key", lambda: produce("first")) == "hasil dari first"
+    assert await second.dedup("key", lambda: produce("second")) == "hasil dari second"
+
+async def test_waiter_takes_over_from_dead_owner(db, first):
+    # Pending entry left behind by a worker that stopped renewing it
+    await db.inflight_generations.insert_one({
+        "_id": "key:1",
+        "key": "key",
+        "generation": 1,
+        "status": "pending",
+        "owner": "dead-worker",
+        "expires_at": datetime.utcnow() - timedelta(seconds=1)
+    })
+
+    async def produce():
+        return "hasil baru"
+
+    assert await first.dedup("key", produce) == "hasil baru"
+    entry = await db.inflight_generations.find_one({"_id": "key:2"})
+    assert entry["owner"] == first.worker_id
+
+async def test_dedup_is_off_by_default(db):
+    service = CoordinationService(db)
+
+    async def produce():
+        return "hasil"
+
+    assert await service.dedup("key", produce) == "hasil"
+    assert await db.inflight_generations.count_documents({}) == 0
+
+async def test_model_slot_waits_with_backoff_then_times_out(first, second):
+    for worker in (first, second):
+        worker.model_max_concurrency = 1
+        worker.model_slot_timeout = 0.1
+
+    async with first.model_slot("sd"):
+        with pytest.raises(ModelSlotTimeout):
+            async with second.model_slot("sd"):
+                pass
+
+    async with second.model_slot("sd"):
+        pass
+
+async def test_image_queue_is_entered_before_the_global_slot(monkeypatch):
+    monkeypatch.setenv("HUGGINGFACE_API_KEY", "test")
+    monkeypatch.setenv("IMAGE_MAX_CONCURRENCY", "1")
+    held_slots = []
+
+    @asynccontextmanager
+    async def model_slot(model):
+        held_slots.append(model)
+        try:
+            yield
+        finally:
+            held_slots.remove(model)
+
+    service = HuggingFaceService(model_slot=model_slot)
+    release = asyncio.Event()
+
+    async def generate(*args):
+        await release.wait()
+        return "data:image/png;base64,"
+
+    monkeypatch.setattr(service, "_generate_image", generate)
+    tasks = [asyncio.create_task(service.generate_image("gunung")) for _ in range(3)]
+    await asyncio.sleep(0.05)
+
+    # Requests still queued locally do not hold a global slot
+    assert len(held_slots) == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert held_slots == []
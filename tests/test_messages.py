@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import server
+from models import MessageCreate
+
+@pytest.fixture
+def app_db(db, monkeypatch):
+    """Point the app and its services at the mock database"""
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server.archive_service, "db", db)
+    monkeypatch.setattr(server.coordination_service, "db", db)
+    return db
+
+@pytest.fixture
+def client(app_db):
+    # Not entered as a context manager, startup would connect to the real database
+    return TestClient(server.app)
+
+@pytest.fixture
+def session_id(client):
+    return client.post("/api/sessions", json={}).json()["id"]
+
+def stub_images(monkeypatch, delays=None, fail=(), error=()):
+    """Replace image generation; variants are identified by their seed"""
+    started = []
+    cancelled = []
+
+    async def generate_image(prompt, seed=None, **kwargs):
+        started.append(seed)
+        try:
+            await asyncio.sleep((delays or {}).get(seed, 0))
+        except asyncio.CancelledError:
+            cancelled.append(seed)
+            raise
+        if seed in error:
+            raise RuntimeError("upstream exploded")
+        if seed in fail:
+            return None
+        return f"data:image/png;base64,{seed}"
+
+    monkeypatch.setattr(server.hf_service, "generate_image", generate_image)
+    return started, cancelled
+
+def image_request(**kwargs):
+    return MessageCreate(content="gunung", message_type="image", **kwargs)
+
+def test_seeds_must_match_num_variants():
+    with pytest.raises(ValidationError):
+        image_request(num_variants=2, seeds=[1])
+    assert image_request(num_variants=2, seeds=[1, 2]).seeds == [1, 2]
+
+def test_image_options_are_rejected_for_text():
+    with pytest.raises(ValidationError):
+        MessageCreate(content="halo", message_type="text", num_variants=2)
+    with pytest.raises(ValidationError):
+        MessageCreate(content="halo", message_type="text", guidance_scale=5)
+
+@pytest.mark.asyncio
+async def test_variants_are_delivered_in_completion_order(app_db, session_id, monkeypatch):
+    stub_images(monkeypatch, delays={1: 0.06, 2: 0.02, 3: 0.04})
+
+    messages = [m async for m in server.generate_image_messages(session_id, image_request(num_variants=3, seeds=[1, 2, 3]))]
+
+    assert [m.variant_index for m in messages] == [1, 2, 0]
+    assert len({m.group_id for m in messages}) == 1
+    assert await app_db.messages.count_documents({"group_id": messages[0].group_id}) == 3
+
+@pytest.mark.asyncio
+async def test_failed_variants_are_skipped(app_db, session_id, monkeypatch):
+    stub_images(monkeypatch, fail={2})
+
+    messages = [m async for m in server.generate_image_messages(session_id, image_request(num_variants=3, seeds=[1, 2, 3]))]
+
+    assert sorted(m.seed for m in messages) == [1, 3]
+
+@pytest.mark.asyncio
+async def test_text_fallback_when_all_variants_fail(app_db, session_id, monkeypatch):
+    stub_images(monkeypatch, fail={1, 2})
+
+    messages = [m async for m in server.generate_image_messages(session_id, image_request(num_variants=2, seeds=[1, 2]))]
+
+    assert len(messages) == 1
+    assert messages[0].content_type == "text"
+    assert await app_db.messages.count_documents({}) == 1
+
+@pytest.mark.asyncio
+async def test_failing_variant_cancels_its_siblings(app_db, session_id, monkeypatch):
+    started, cancelled = stub_images(monkeypatch, delays={1: 10, 3: 10}, error={2})
+
+    with pytest.raises(RuntimeError):
+        async for _ in server.generate_image_messages(session_id, image_request(num_variants=3, seeds=[1, 2, 3])):
+            pass
+
+    assert sorted(started) == [1, 2, 3]
+    assert sorted(cancelled) == [1, 3]
+
+def test_send_message_rejects_multiple_variants(client, session_id):
+    response = client.post(f"/api/sessions/{session_id}/messages", json={
+        "content": "gunung",
+        "message_type": "image",
+        "num_variants": 2
+    })
+    assert response.status_code == 400
+
+def test_stream_writes_one_message_per_line(client, session_id, monkeypatch):
+    stub_images(monkeypatch)
+
+    response = client.post(f"/api/sessions/{session_id}/messages/stream", json={
+        "content": "gunung",
+        "message_type": "image",
+        "num_variants": 2,
+        "seeds": [1, 2]
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["seed"] for line in lines) == [1, 2]
+    assert all(line["type"] == "assistant" and line["content_type"] == "image" for line in lines)
+
+def test_stream_ends_with_an_error_line_on_failure(client, session_id, monkeypatch):
+    stub_images(monkeypatch, error={1})
+
+    response = client.post(f"/api/sessions/{session_id}/messages/stream", json={
+        "content": "gunung",
+        "message_type": "image",
+        "seeds": [1]
+    })
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{"error": "Failed to send message"}]
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services import tracing
+from services.tracing import RequestTracer, span
+
+def make_client():
+    """Build a small traced app, the middleware reads its settings on the first request"""
+    app = FastAPI()
+
+    @app.get("/plain")
+    async def plain():
+        with span("db"):
+            pass
+        with span("db"):
+            pass
+        with span("model"):
+            pass
+        return {}
+
+    @app.get("/fan-out")
+    async def fan_out():
+        async def variant():
+            with span("variant"):
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(asyncio.create_task(variant()) for _ in range(3)))
+        return {}
+
+    app.add_middleware(RequestTracer)
+    return TestClient(app)
+
+class FakeProfiler:
+    started = 0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def start(self):
+        FakeProfiler.started += 1
+
+    def stop(self):
+        pass
+
+    def output_text(self):
+        return "profile"
+
+@pytest.fixture
+def profiler(monkeypatch):
+    FakeProfiler.started = 0
+    monkeypatch.setattr(tracing, "Profiler", FakeProfiler)
+    return FakeProfiler
+
+def timing_entries(response):
+    entries = [entry.split(";") for entry in response.headers["server-timing"].split(", ")]
+    return {entry[0]: entry[1:] for entry in entries}
+
+def test_untraced_requests_have_no_server_timing():
+    response = make_client().get("/plain")
+
+    assert response.status_code == 200
+    assert "server-timing" not in response.headers
+
+def test_spans_are_aggregated_per_name():
+    entries = timing_entries(make_client().get("/plain", headers={"X-Trace": "1"}))
+
+    assert entries["db"][0].startswith("dur=")
+    assert entries["db"][1] == 'desc="2x"'
+    assert entries["model"][1] == 'desc="1x"'
+    assert "total" in entries
+
+def test_spans_in_child_tasks_belong_to_the_request():
+    entries = timing_entries(make_client().get("/fan-out", headers={"X-Trace": "1"}))
+
+    assert entries["variant"][1] == 'desc="3x"'
+
+def test_slow_requests_are_logged(monkeypatch, caplog):
+    monkeypatch.setenv("TRACE_SLOW_MS", "0")
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "1")
+
+    with caplog.at_level(logging.INFO, logger="services.tracing"):
+        make_client().get("/plain")
+
+    records = [record for record in caplog.records if record.getMessage().startswith("Request trace: ")]
+    assert len(records) == 1
+    assert records[0].levelno == logging.WARNING
+    assert '"path": "/plain"' in records[0].getMessage()
+
+def test_fast_requests_are_not_logged_unless_traced(monkeypatch, caplog):
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "1")
+
+    with caplog.at_level(logging.INFO, logger="services.tracing"):
+        make_client().get("/plain")
+
+    assert not [record for record in caplog.records if record.getMessage().startswith("Request trace: ")]
+
+def test_profile_header_is_ignored_by_default(profiler):
+    response = make_client().get("/plain", headers={"X-Trace": "profile"})
+
+    assert "server-timing" in response.headers
+    assert profiler.started == 0
+
+def test_profile_header_starts_the_profiler_when_allowed(monkeypatch, profiler):
+    monkeypatch.setenv("TRACE_ALLOW_PROFILE_HEADER", "1")
+
+    make_client().get("/plain", headers={"X-Trace": "profile"})
+
+    assert profiler.started == 1